@@ -1,55 +1,184 @@
 #!/usr/bin/env python3
-import rtmidi
 import json
+import os
 import socket
 import sys
 import signal
-from pythonosc import udp_client
+import threading
+import time
+import orjson
+
+# Save controls.json after this many new mappings in learn mode
+SAVE_INTERVAL = 16
+
+# Minimum time between OSC send batches in normal mode (seconds)
+SEND_INTERVAL = 0.005
+
+# Normalized fader level for each MIDI value 0-127
+FADER_VALUES = tuple(i / 127.0 for i in range(128))
+
+# OSC values sent for a button toggled off/on (XR18 mute is inverted)
+BUTTON_VALUES = {"mute": (1, 0), "solo": (0, 1)}
+
+# XR18 OSC paths per channel and control type
+MASTER_PATHS = {
+    "volume": "/lr/mix/fader",
+    "mute": "/lr/mix/on",
+    "solo": "/-stat/solosw/lr"
+}
+AUX_PATHS = {
+    "volume": "/rtn/aux/mix/fader",
+    "mute": "/rtn/aux/mix/on",
+    "solo": "/rtn/aux/mix/solo"
+}
+CH_PATHS = {
+    ch: {
+        "volume": f"/ch/{ch:02d}/mix/fader",
+        "mute": f"/ch/{ch:02d}/mix/on",
+        "solo": f"/-stat/solosw/{ch:02d}"
+    }
+    for ch in range(1, 17)
+}
 
 def load_config():
     """Load configuration from config.json."""
     try:
-        with open('config.json', 'r') as f:
+        with open('config.json', 'r', encoding='utf-8') as f:
             return json.load(f)
     except FileNotFoundError:
         print("config.json not found. Using defaults.")
         return {"xr18_ip": "192.168.1.100", "xr18_port": 10024, "midi_device": None}
 
 def check_xr18_connection(ip, port):
-    """Check if XR18 is reachable."""
-    import subprocess
+    """Check if XR18 is reachable by sending an OSC /xinfo query."""
     try:
-        result = subprocess.run(['ping', '-c', '1', '-W', '2000', ip], 
-                              capture_output=True, text=True)
-        return result.returncode == 0
-    except:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(0.5)
+            s.sendto(b'/xinfo\x00\x00,\x00\x00\x00', (ip, port))
+            s.recv(512)
+        return True
+    except OSError:
         return False
 
+def osc_paths_for(channel):
+    """Return the OSC paths for a channel number, 'aux' or 'master'."""
+    if channel == 'master':
+        return MASTER_PATHS
+    if channel == 'aux':
+        return AUX_PATHS
+    return CH_PATHS[channel]
+
+def start_osc_sender(osc_client):
+    """Start a background thread sending coalesced OSC messages.
+
+    Returns a function that queues a message. Only the latest value queued
+    for each OSC path between two batches is sent.
+    """
+    pending = {}
+    wake = threading.Event()
+    
+    def sender():
+        while True:
+            wake.wait()
+            wake.clear()
+            while pending:
+                path, value = pending.popitem()
+                # Keep the thread alive on transient network errors
+                try:
+                    osc_client.send_message(path, value)
+                except OSError as e:
+                    print(f"OSC send to {path} failed: {e}")
+            time.sleep(SEND_INTERVAL)
+    
+    threading.Thread(target=sender, daemon=True).start()
+    
+    def send(path, value):
+        pending[path] = value
+        wake.set()
+    
+    return send
+
+def parse_channel(text):
+    """Parse a channel number (1-16), 'aux' or 'master'; return None if invalid."""
+    text = text.strip().lower()
+    if text in ('aux', 'master'):
+        return text
+    try:
+        channel = int(text)
+    except ValueError:
+        return None
+    return channel if 1 <= channel <= 16 else None
+
+def build_mapping(channel, control_type):
+    """Build the controls.json entry for a channel and control type."""
+    return {
+        "activity": control_type,
+        "channel": channel,
+        "osc_path": osc_paths_for(channel)[control_type]
+    }
+
 def list_midi_devices():
     """List available MIDI input devices."""
+    import rtmidi
     midiin = rtmidi.MidiIn()
     ports = midiin.get_ports()
     midiin.close_port()
     return ports
 
+def write_json(path, obj, sort_keys=False):
+    """Atomically write obj to path as indented JSON."""
+    option = orjson.OPT_INDENT_2
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    data = orjson.dumps(obj, option=option)
+    # Write a temp file and rename it so an interrupted save keeps the old file
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
 def save_config(config):
     """Save configuration to config.json."""
-    with open('config.json', 'w') as f:
-        json.dump(config, f, indent=2)
+    write_json('config.json', config)
+
+def control_name(key):
+    """Return the controls.json name ("status_data1") of a control key."""
+    return "_".join(map(str, key))
+
+def parse_control_name(name):
+    """Return the control key for a controls.json name, or None if invalid."""
+    try:
+        key = tuple(int(x) for x in name.split('_'))
+    except ValueError:
+        return None
+    if len(key) not in (1, 2) or not 0 <= key[0] <= 255:
+        return None
+    if len(key) == 2 and not 0 <= key[1] <= 127:
+        return None
+    return key
 
 def save_controls(controls):
-    """Save MIDI controls to controls.json."""
-    with open('controls.json', 'w') as f:
-        json.dump(controls, f, indent=2)
+    """Save MIDI controls to controls.json, sorted by name."""
+    write_json('controls.json', {control_name(k): v for k, v in controls.items()},
+               sort_keys=True)
 
 def load_controls():
     """Load MIDI controls from controls.json."""
     try:
-        with open('controls.json', 'r') as f:
-            return json.load(f)
+        with open('controls.json', 'r', encoding='utf-8') as f:
+            controls = json.load(f)
     except FileNotFoundError:
         print("controls.json not found. Run with --learn first.")
         return {}
+    # Controls are keyed by (status, data1) tuples in memory
+    parsed = {}
+    for name, control in controls.items():
+        key = parse_control_name(name)
+        if key is None:
+            print(f"Skipping invalid control {name!r} in controls.json")
+            continue
+        parsed[key] = control
+    return parsed
 
 def map_controls():
     """Map controls to XR18 functions."""
@@ -64,94 +193,47 @@ def map_controls():
     
     print(f"Mapping {len(unmapped)} unmapped controls...")
     
-    for control_key in unmapped:
-        print(f"\nControl: {control_key}")
-        
-        channel_input = input("Channel number (1-16, 'aux', or 'master'): ").strip().lower()
-        if channel_input == 'master':
-            channel = 'master'
-        elif channel_input == 'aux':
-            channel = 'aux'
-        else:
+    # Keep mappings entered so far if the user stops with Ctrl+C
+    try:
+        for control_key in unmapped:
+            print(f"\nControl: {control_name(control_key)}")
+            
+            channel = parse_channel(input("Channel number (1-16, 'aux', or 'master'): "))
+            if channel is None:
+                print("Invalid channel. Skipping.")
+                continue
+            
+            print("Control type:")
+            print("1: volume")
+            print("2: mute")
+            print("3: solo")
+            
             try:
-                channel = int(channel_input)
-                if not 1 <= channel <= 16:
-                    print("Invalid channel. Skipping.")
+                choice = int(input("Select (1-3): "))
+                control_types = {1: "volume", 2: "mute", 3: "solo"}
+                if choice not in control_types:
+                    print("Invalid choice. Skipping.")
                     continue
+                control_type = control_types[choice]
             except ValueError:
                 print("Invalid input. Skipping.")
                 continue
-        
-        print("Control type:")
-        print("1: volume")
-        print("2: mute")
-        print("3: solo")
-        
-        try:
-            choice = int(input("Select (1-3): "))
-            control_types = {1: "volume", 2: "mute", 3: "solo"}
-            if choice not in control_types:
-                print("Invalid choice. Skipping.")
-                continue
-            control_type = control_types[choice]
-        except ValueError:
-            print("Invalid input. Skipping.")
-            continue
-        
-        osc_paths = {
-            "volume": f"/ch/{channel:02d}/mix/fader",
-            "mute": f"/ch/{channel:02d}/mix/on",
-            "solo": f"/-stat/solosw/{channel:02d}"
-        }
-        
-        if channel == 'master':
-            osc_paths = {
-                "volume": "/lr/mix/fader",
-                "mute": "/lr/mix/on",
-                "solo": "/-stat/solosw/lr"
-            }
-        elif channel == 'aux':
-            osc_paths = {
-                "volume": "/rtn/aux/mix/fader",
-                "mute": "/rtn/aux/mix/on",
-                "solo": "/rtn/aux/mix/solo"
-            }
-        else:
-            osc_paths = {
-                "volume": f"/ch/{channel:02d}/mix/fader",
-                "mute": f"/ch/{channel:02d}/mix/on",
-                "solo": f"/-stat/solosw/{channel:02d}"
-            }
-        
-
-        
-        controls[control_key] = {
-            "activity": control_type,
-            "channel": channel,
-            "osc_path": osc_paths[control_type]
-        }
+            
+            controls[control_key] = build_mapping(channel, control_type)
+    except KeyboardInterrupt:
+        print()
     
     save_controls(controls)
     print(f"\nMapping saved to controls.json")
 
 def map_control(key):
     """Map a single control to XR18 function."""
-    print(f"\nNew control: {key}")
+    print(f"\nNew control: {control_name(key)}")
     
-    channel_input = input("Channel number (1-16, 'aux', or 'master'): ").strip().lower()
-    if channel_input == 'master':
-        channel = 'master'
-    elif channel_input == 'aux':
-        channel = 'aux'
-    else:
-        try:
-            channel = int(channel_input)
-            if not 1 <= channel <= 16:
-                print("Invalid channel. Skipping.")
-                return None
-        except ValueError:
-            print("Invalid input. Skipping.")
-            return None
+    channel = parse_channel(input("Channel number (1-16, 'aux', or 'master'): "))
+    if channel is None:
+        print("Invalid channel. Skipping.")
+        return None
     
     print("Control type:")
     print("1: volume")
@@ -169,32 +251,43 @@ def map_control(key):
         print("Invalid input. Skipping.")
         return None
     
-    if channel == 'master':
-        osc_paths = {
-            "volume": "/lr/mix/fader",
-            "mute": "/lr/mix/on",
-            "solo": "/-stat/solosw/lr"
-        }
-    elif channel == 'aux':
-        osc_paths = {
-            "volume": "/rtn/aux/mix/fader",
-            "mute": "/rtn/aux/mix/on",
-            "solo": "/rtn/aux/mix/solo"
-        }
-    else:
-        osc_paths = {
-            "volume": f"/ch/{channel:02d}/mix/fader",
-            "mute": f"/ch/{channel:02d}/mix/on",
-            "solo": f"/-stat/solosw/{channel:02d}"
-        }
-    
+    return build_mapping(channel, control_type)
 
+def import_controls(path):
+    """Map controls from a tab-separated file of key, channel and control type."""
+    try:
+        with open(path, 'r') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        print(f"{path} not found.")
+        return
     
-    return {
-        "activity": control_type,
-        "channel": channel,
-        "osc_path": osc_paths[control_type]
-    }
+    controls = load_controls() if os.path.exists('controls.json') else {}
+    count = 0
+    
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            name, channel, control_type = line.split('\t')
+            key = parse_control_name(name.strip())
+            if key is None:
+                raise ValueError
+            channel = parse_channel(channel)
+            if channel is None:
+                raise ValueError
+            control_type = control_type.strip().lower()
+            if control_type not in ("volume", "mute", "solo"):
+                raise ValueError
+        except ValueError:
+            print(f"Line {line_number}: invalid mapping. Skipping.")
+            continue
+        controls[key] = build_mapping(channel, control_type)
+        count += 1
+    
+    save_controls(controls)
+    print(f"Imported {count} controls to controls.json")
 
 def learn_controls(midiin, force_learn=False):
     """Learn MIDI controls and create sorted list."""
@@ -202,23 +295,32 @@ def learn_controls(midiin, force_learn=False):
     mode_text = "Force-learn mode" if force_learn else "Learn mode"
     print(f"{mode_text}: Press MIDI controls. Press Ctrl+C to exit and save.")
     
-    def midi_callback(msg, data):
+    # Number of new mappings since the last write to controls.json
+    unsaved = 0
+    
+    def midi_callback(msg, data, _map=map_control, _save=save_controls):
+        nonlocal unsaved
         if msg[0]:
-            key = f"{msg[0][0]}_{msg[0][1]}" if len(msg[0]) > 1 else str(msg[0][0])
-            value = msg[0][2] if len(msg[0]) > 2 else None
-            
+            raw = msg[0]
             # Skip button release events (value 0) during mapping
-            if value == 0:
+            if len(raw) > 2 and raw[2] == 0:
                 return
             
+            key = (raw[0], raw[1]) if len(raw) > 1 else (raw[0],)
+            value = raw[2] if len(raw) > 2 else None
+            
             # Check if control is new or has no activity (or force-learn mode)
             if key not in controls or controls[key].get('activity') is None or force_learn:
-                print(f"Control: {key}, Value: {value}")
-                mapping = map_control(key)
+                print(f"Control: {control_name(key)}, Value: {value}")
+                mapping = _map(key)
                 if mapping:
                     controls[key] = mapping
-                    save_controls(controls)
-                    print(f"Mapped {key} -> {mapping['osc_path']}")
+                    print(f"Mapped {control_name(key)} -> {mapping['osc_path']}")
+                    # Mappings are saved on exit; flush periodically as a safety net
+                    unsaved += 1
+                    if unsaved >= SAVE_INTERVAL:
+                        _save(controls)
+                        unsaved = 0
                 else:
                     controls[key] = {"activity": None}
     
@@ -226,16 +328,16 @@ def learn_controls(midiin, force_learn=False):
     
     def signal_handler(sig, frame):
         midiin.cancel_callback()
-        sorted_controls = dict(sorted(controls.items()))
-        save_controls(sorted_controls)
-        print(f"\nSaved {len(sorted_controls)} controls to controls.json")
+        save_controls(controls)
+        print(f"\nSaved {len(controls)} controls to controls.json")
         sys.exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
     
     try:
+        # Sleep until a signal arrives; MIDI events are handled on rtmidi's thread
         while True:
-            pass
+            signal.pause()
     except KeyboardInterrupt:
         signal_handler(None, None)
 
@@ -267,6 +369,16 @@ def select_device(devices, saved_device=None):
 def main():
     learn_mode = "--learn" in sys.argv
     force_learn_mode = "--force-learn" in sys.argv
+    verbose = "--verbose" in sys.argv
+    
+    if "--map" in sys.argv:
+        index = sys.argv.index("--map") + 1
+        if index >= len(sys.argv):
+            print("Usage: main.py --map FILE")
+            return
+        import_controls(sys.argv[index])
+        return
+    
     config = load_config()
     
     if not learn_mode and not force_learn_mode:
@@ -284,7 +396,8 @@ def main():
                 config['xr18_ip'] = new_ip
                 save_config(config)
         
-        # Setup OSC client
+        # Setup OSC client; pythonosc is only needed in normal mode
+        from pythonosc import udp_client
         osc_client = udp_client.SimpleUDPClient(config['xr18_ip'], config['xr18_port'])
         
         # Send /xremote to enable remote control
@@ -303,6 +416,7 @@ def main():
             save_config(config)
         
         # Connect to MIDI device
+        import rtmidi
         midiin = rtmidi.MidiIn()
         midiin.open_port(device_index)
         
@@ -317,35 +431,54 @@ def main():
             
             print("Normal mode: Processing MIDI events. Press Ctrl+C to exit.")
             
-            # Track button states for toggle functionality
-            button_states = {}
+            # Track button states for toggle functionality, one bit per button
+            button_bits = 0
+            
+            # Build the MIDI key -> OSC path lookups once, split so that
+            # button releases only need to be checked against the faders
+            faders = {k: v['osc_path'] for k, v in controls.items()
+                      if v.get('osc_path') and v['activity'] == 'volume'}
+            button_keys = [k for k, v in controls.items()
+                           if v.get('osc_path') and v['activity'] in BUTTON_VALUES]
+            buttons = {k: (1 << i, BUTTON_VALUES[controls[k]['activity']], controls[k]['osc_path'])
+                       for i, k in enumerate(button_keys)}
+            # Fader moves are coalesced per path; buttons are sent immediately
+            send_fader = start_osc_sender(osc_client)
             
-            def midi_callback(msg, data):
+            # Lookups are bound as default arguments to keep them local to the callback
+            def midi_callback(msg, data, _faders=faders.get, _buttons=buttons.get,
+                              _send_fader=send_fader, _send=osc_client.send_message,
+                              _len=len, _verbose=verbose,
+                              _levels=FADER_VALUES):
+                nonlocal button_bits
                 if msg[0]:
-                    key = f"{msg[0][0]}_{msg[0][1]}" if len(msg[0]) > 1 else str(msg[0][0])
-                    value = msg[0][2] if len(msg[0]) > 2 else 0
+                    raw = msg[0]
+                    key = (raw[0], raw[1]) if _len(raw) > 1 else (raw[0],)
+                    value = raw[2] if _len(raw) > 2 else 0
+                    
+                    osc_path = _faders(key)
+                    if osc_path is not None:
+                        normalized_value = _levels[value]
+                        _send_fader(osc_path, normalized_value)
+                        if _verbose:
+                            print(f"MIDI {control_name(key)}={value} -> OSC {osc_path}={normalized_value}")
+                        return
                     
-                    if key in controls and controls[key].get('osc_path'):
-                        osc_path = controls[key]['osc_path']
-                        activity = controls[key]['activity']
+                    # Only on button press
+                    if value == 0:
+                        return
+                    
+                    entry = _buttons(key)
+                    if entry is not None:
+                        bit, values, osc_path = entry
+                        
+                        # Toggle button state
+                        button_bits ^= bit
+                        normalized_value = values[(button_bits & bit) != 0]
                         
-                        if activity == 'volume':
-                            normalized_value = value / 127.0
-                            osc_client.send_message(osc_path, normalized_value)
-                            print(f"MIDI {key}={value} -> OSC {osc_path}={normalized_value}")
-                        elif activity in ['mute', 'solo'] and value > 0:  # Only on button press
-                            # Toggle button state
-                            current_state = button_states.get(key, False)
-                            new_state = not current_state
-                            button_states[key] = new_state
-                            
-                            if activity == 'mute':
-                                normalized_value = 0 if new_state else 1  # XR18 mute is inverted
-                            else:  # solo
-                                normalized_value = 1 if new_state else 0
-                            
-                            osc_client.send_message(osc_path, normalized_value)
-                            print(f"MIDI {key} toggle -> OSC {osc_path}={normalized_value}")
+                        _send(osc_path, normalized_value)
+                        if _verbose:
+                            print(f"MIDI {control_name(key)} toggle -> OSC {osc_path}={normalized_value}")
             
             midiin.set_callback(midi_callback)
             
@@ -357,8 +490,9 @@ def main():
             signal.signal(signal.SIGINT, signal_handler)
             
             try:
+                # Sleep until a signal arrives; MIDI events are handled on rtmidi's thread
                 while True:
-                    pass
+                    signal.pause()
             except KeyboardInterrupt:
                 signal_handler(None, None)
         